@@ -0,0 +1,28 @@
+# gunicorn -c gunicorn.conf.py app:app
+# Patch before anything imports ssl/socket (preload imports app, boto3, twilio
+# in the master process).
+from gevent import monkey
+monkey.patch_all()
+
+# psycopg2 is a C driver; make its waits yield to other greenlets
+from psycogreen.gevent import patch_psycopg
+patch_psycopg()
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+# Each worker holds up to DB_POOL_SIZE + DB_MAX_OVERFLOW Postgres connections;
+# the default cap keeps 4 workers x 10 well under max_connections (100).
+workers = int(os.getenv("WEB_CONCURRENCY", min(multiprocessing.cpu_count() * 2 + 1, 4)))
+worker_class = "gevent"
+worker_connections = 1000
+preload_app = True
+timeout = 30
+
+
+def post_fork(server, worker):
+    # Connections opened in the master at import time must not be shared
+    # with the workers; give each worker a fresh pool.
+    from app import engine
+    engine.dispose(close=False)
@@ -54,3 +54,12 @@ INSERT INTO technicians (name, whatsapp, active) VALUES
 ('Tech_A', 'whatsapp:+1571XXXXXXX', true),
 ('Tech_B', 'whatsapp:+1703XXXXXXX', true)
 ON CONFLICT (name) DO NOTHING;
+
+-- Lookups used by technician commands
+CREATE INDEX IF NOT EXISTS ix_tech_whatsapp ON technicians (whatsapp);
+CREATE INDEX IF NOT EXISTS ix_tech_name_ci ON technicians (lower(name));
+CREATE INDEX IF NOT EXISTS ix_job_assigned_to ON jobs (assigned_to_id);
+
+-- Intake: latest draft job per customer
+CREATE INDEX IF NOT EXISTS ix_jobs_draft ON jobs (customer_phone, id DESC) WHERE status = 'draft';
+CREATE INDEX IF NOT EXISTS ix_jobs_status_assigned ON jobs (status, assigned_to_id);
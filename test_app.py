@@ -1,5 +1,18 @@
+import asyncio
 import os
+import tempfile
+import threading
 import pytest
+
+# The app connects at import time; run the suite against a throwaway SQLite db
+_TEST_DB = os.path.join(tempfile.gettempdir(), 'mdts_test.db')
+if os.path.exists(_TEST_DB):
+    os.remove(_TEST_DB)
+os.environ['DATABASE_URL'] = f'sqlite:///{_TEST_DB}'
+os.environ.setdefault('TWILIO_ACCOUNT_SID', 'ACtest')
+os.environ.setdefault('TWILIO_AUTH_TOKEN', 'test-token')
+
+import app as app_module
 from app import app
 
 
@@ -45,3 +58,239 @@ def test_environment_variables():
 
     for var in required_vars:
         assert var in env_content, f"Required environment variable {var} not found in .env.example"
+
+
+def test_normalize_model():
+    """Test that model aliases resolve regardless of spacing and case."""
+    from app import normalize_model
+    assert normalize_model("14 Pro Max") == "14promax"
+    assert normalize_model("  14   pro ") == "14pro"
+    assert normalize_model("16PROMAX") == "16promax"
+    assert normalize_model("nokia") is None
+    assert normalize_model("") is None
+
+
+def test_twiml_reply():
+    """Test that replies are escaped TwiML served as XML."""
+    from app import twiml, HELP_TXT
+    resp = twiml("Job #1 <ok> & done")
+    assert resp.mimetype == 'application/xml'
+    assert b'<Message><Body>Job #1 &lt;ok&gt; &amp; done</Body></Message>' in resp.get_data()
+    assert twiml(HELP_TXT).get_data().startswith(b'<?xml')
+
+
+
+@pytest.fixture
+def webhook(client, monkeypatch):
+    """Post to /whatsapp with signature checks and outbound SMS stubbed."""
+    monkeypatch.setattr(app_module.validator, 'validate', lambda *args: True)
+    monkeypatch.setattr(app_module, 'sms', lambda *args, **kwargs: None)
+    monkeypatch.setattr(app_module, 'REDIS', None)
+    monkeypatch.setattr(app_module, 's3', None)
+
+    def post(sender, body, media_url=None):
+        data = {'From': sender, 'Body': body, 'NumMedia': '1' if media_url else '0'}
+        if media_url:
+            data['MediaUrl0'] = media_url
+        response = client.post('/whatsapp', data=data)
+        assert response.status_code == 200
+        return response.get_data(as_text=True)
+    return post
+
+
+def test_setprice_then_price(webhook):
+    """Test that /setprice upserts a price that /price reads back."""
+    admin = 'whatsapp:+10000000001'
+    assert 'Set *15promax* = $230.00 (+$15.00 with cable)' in webhook(admin, '/setprice 15 pro max 230 +15')
+    assert 'Price for *15promax*: $230.00 (+$15.00 with cable)' in webhook(admin, '/price 15promax')
+    assert 'Set *15promax* = $240.00 (+$0.00 with cable)' in webhook(admin, '/setprice 15promax 240')
+    assert 'Price for *15promax*: $240.00 (+$0.00 with cable)' in webhook(admin, '/price 15 pro max')
+
+
+def _make_job(**fields):
+    with app_module.SessionLocal() as db:
+        job = app_module.Job(**fields)
+        db.add(job)
+        db.commit()
+        return job.id
+
+
+def test_job_id_arguments(webhook):
+    """Test that non-numeric job ids fall through to help instead of erroring."""
+    admin = 'whatsapp:+10000000003'
+    job_id = _make_job(customer_phone=admin, model='13promax', qty=2, status='open')
+    assert 'MTS Service Bot' in webhook(admin, '/total abc')
+    assert 'MTS Service Bot' in webhook(admin, '/status 1x')
+    reply = webhook(admin, f'/total {job_id}')
+    assert f'Total for job #{job_id}' in reply
+    assert 'Labor ($50 × 2): $100.00' in reply
+
+
+def test_tech_commands_require_assignment(webhook):
+    """Test that only the assigned technician can act on a job."""
+    tech_phone = 'whatsapp:+10000000004'
+    other = 'whatsapp:+10000000005'
+    with app_module.SessionLocal() as db:
+        tech = app_module.Technician(name='Tess', whatsapp=tech_phone)
+        db.add(tech)
+        db.commit()
+        tech_id = tech.id
+    job_id = _make_job(customer_phone=other, model='14pro', qty=1, status='assigned',
+                       assigned_to_id=tech_id)
+    unassigned_id = _make_job(customer_phone=other, model='14pro', qty=1, status='open')
+
+    assert 'Job not found or not assigned to you.' in webhook(other, f'/done {job_id}')
+    assert 'Job not found or not assigned to you.' in webhook(tech_phone, f'/accept {unassigned_id}')
+    assert f'Accepted job #{job_id}' in webhook(tech_phone, f'/accept {job_id}')
+    assert f'Marked job #{job_id} as done.' in webhook(tech_phone, f'/done {job_id}')
+
+
+def _reply(text):
+    return app_module.twiml(text).get_data(as_text=True)
+
+
+def _start_intake(webhook, sender):
+    reply = webhook(sender, '', media_url='https://api.twilio.com/Media/ME1')
+    assert 'Created draft job #' in reply
+    return int(reply.split('draft job #')[1].split('.')[0])
+
+
+def _get_job(job_id):
+    with app_module.SessionLocal() as db:
+        return db.get(app_module.Job, job_id)
+
+
+def _run_intake(webhook, sender):
+    """Photo through step 4; returns (job_id, final reply)."""
+    job_id = _start_intake(webhook, sender)
+    assert webhook(sender, '14 Pro Max') == _reply(app_module.ASK_QTY)
+    assert webhook(sender, '2') == _reply(app_module.ASK_CABLE)
+    assert webhook(sender, 'yes') == _reply(app_module.ASK_NOTES)
+    return job_id, webhook(sender, 'handle with care')
+
+
+@pytest.fixture
+def fake_redis(webhook, monkeypatch):
+    """Keep intake state in an in-memory Redis."""
+    fakeredis = pytest.importorskip('fakeredis')
+    server = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(app_module, 'REDIS', server)
+    return server
+
+
+@pytest.mark.parametrize('use_redis', [False, True])
+def test_photo_intake(webhook, request, use_redis):
+    """Test the photo intake through step 4 and /cancel, with and without Redis."""
+    redis_server = request.getfixturevalue('fake_redis') if use_redis else None
+    customer = f'whatsapp:+1000000010{int(use_redis)}'
+
+    job_id, reply = _run_intake(webhook, customer)
+    assert f'Job #{job_id} opened.' in reply
+    assert 'Model: 14promax | Qty: 2 | Cable: yes' in reply
+    job = _get_job(job_id)
+    assert (job.status, job.intake_step, job.model, job.qty, job.include_cable, job.notes) == \
+        ('open', 0, '14promax', 2, True, 'handle with care')
+    if redis_server is not None:
+        assert not redis_server.exists(f'intake:{customer}')
+
+    job_id = _start_intake(webhook, customer)
+    assert webhook(customer, '/cancel') == _reply(app_module.INTAKE_CANCELED)
+    assert _get_job(job_id).status == 'canceled'
+    assert webhook(customer, '/cancel') == _reply(app_module.NO_INTAKE)
+
+
+def test_redis_intake_job_assigned_midway(webhook, fake_redis):
+    """Test that finishing intake doesn't reopen a draft assigned in the meantime."""
+    customer = 'whatsapp:+10000000110'
+    with app_module.SessionLocal() as db:
+        db.add(app_module.Technician(name='Rhea', whatsapp='whatsapp:+10000000111'))
+        db.commit()
+    job_id = _start_intake(webhook, customer)
+    assert webhook(customer, '14pro') == _reply(app_module.ASK_QTY)
+    assert 'Assigned job' in webhook('whatsapp:+10000000112', f'/assign {job_id} Rhea')
+    assert webhook(customer, '1') == _reply(app_module.ASK_CABLE)
+    assert webhook(customer, 'no') == _reply(app_module.ASK_NOTES)
+
+    reply = webhook(customer, 'none')
+    assert reply == _reply(app_module.HELP_TXT)
+    job = _get_job(job_id)
+    assert job.status == 'assigned' and job.assigned_to_id is not None
+    assert not fake_redis.exists(f'intake:{customer}')
+
+
+def test_redis_intake_fragment_is_dropped(webhook, fake_redis):
+    """Test that an intake hash recreated without job_id is treated as no intake."""
+    customer = 'whatsapp:+10000000120'
+    fake_redis.hset(f'intake:{customer}', mapping={'qty': 3, 'step': 3})
+    assert webhook(customer, 'yes') == _reply(app_module.HELP_TXT)
+    assert not fake_redis.exists(f'intake:{customer}')
+    assert webhook(customer, '/cancel') == _reply(app_module.NO_INTAKE)
+
+
+def test_upload_to_s3_async_streams_media(monkeypatch):
+    """Test that the async upload streams the Twilio media to the job's S3 key."""
+    httpx = pytest.importorskip('httpx')
+    pytest.importorskip('aioboto3')
+    chunks = [b'a' * 10, b'b' * 10, b'c' * 5]
+
+    async def media_body():
+        for chunk in chunks:
+            yield chunk
+
+    def handler(request):
+        assert str(request.url) == 'https://api.twilio.com/Media/ME9?x=1'
+        return httpx.Response(200, headers={'Content-Type': 'image/jpeg'}, content=media_body())
+
+    class StubS3:
+        async def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None, Config=None):
+            self.reads = []
+            while data := await fileobj.read(8):
+                self.reads.append(data)
+            self.bucket, self.key, self.extra = bucket, key, ExtraArgs
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http_client:
+            monkeypatch.setattr(app_module, '_aio', (None, http_client, s3_client))
+            return await app_module.upload_to_s3_async('https://api.twilio.com/Media/ME9?x=1', 7)
+
+    s3_client = StubS3()
+    monkeypatch.setattr(app_module, 'AWS_S3_BUCKET', 'bucket')
+    assert asyncio.run(run()) == 's3://bucket/jobs/7/ME9'
+    assert (s3_client.bucket, s3_client.key) == ('bucket', 'jobs/7/ME9')
+    assert s3_client.extra['ContentType'] == 'image/jpeg'
+    assert all(len(data) <= 8 for data in s3_client.reads)
+    assert b''.join(s3_client.reads) == b''.join(chunks)
+
+
+def test_upload_in_background_falls_back_when_async_setup_fails(monkeypatch):
+    """Test that a failure opening the async clients falls back to the thread pool."""
+    aioboto3 = pytest.importorskip('aioboto3')
+    pytest.importorskip('httpx')
+
+    def broken_session():
+        raise RuntimeError('no credentials')
+
+    submitted = []
+    monkeypatch.setattr(aioboto3, 'Session', broken_session)
+    monkeypatch.setattr(app_module, '_aio', None)
+    monkeypatch.setattr(app_module, '_gevent_patched', lambda: False)
+    monkeypatch.setattr(app_module.EXEC, 'submit', lambda *args: submitted.append(args))
+
+    app_module.upload_in_background(3, 'https://api.twilio.com/Media/ME3')
+    assert submitted == [(app_module._upload_and_update, 3, 'https://api.twilio.com/Media/ME3')]
+    assert app_module._aio is None
+    for thread in threading.enumerate():
+        if thread.name == 'media-upload':
+            thread.join(timeout=1)
+            assert not thread.is_alive()
+
+
+def test_tz_sets_user_pref(webhook):
+    """Test that /tz stores the timezone and replies with the local time in it."""
+    sender = 'whatsapp:+10000000130'
+    assert webhook(sender, '/tz Mars/Olympus') == _reply(app_module.INVALID_TZ)
+    assert 'Timezone set to *Asia/Tokyo*' in webhook(sender, '/tz Asia/Tokyo')
+    assert 'Timezone set to *Europe/Paris*' in webhook(sender, '/tz Europe/Paris')
+    with app_module.SessionLocal() as db:
+        prefs = db.query(app_module.UserPref).filter_by(phone=sender).all()
+        assert [pref.tz for pref in prefs] == ['Europe/Paris']